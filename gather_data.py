@@ -1,18 +1,84 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import sqlite3
 import re
+import time
+import threading
 import bs4
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    # orjson parses bytes straight to dicts and is several times faster;
+    # its JSONDecodeError subclasses json.JSONDecodeError
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+try:
+    import lxml  # noqa: F401  (only needed as a BeautifulSoup backend)
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
 
 GOOGLE_BOOKS_URL = "https://www.googleapis.com/books/v1/volumes"
 OMDB_URL = "https://www.omdbapi.com/"
 OMDB_API_KEY = "d4a57588" # Change here
+OMDB_KEY_PLACEHOLDER = "YOUR_OMDB_API_KEY_HERE"
 DB_NAME = "final_project.db"
+API_CACHE_DB = "api_cache.sqlite"     # on-disk cache of API JSON responses
+API_CACHE_TTL = 7 * 24 * 60 * 60     # seconds before a cached response expires
 maximumcount = 300 
+MAX_API_WORKERS = 10  # titles fetched from the APIs at the same time
+
+# Connection tuning: WAL journal with NORMAL sync (no fsync on every
+# commit, still crash-safe), 64 MB page cache, in-memory temp tables,
+# 256 MB memory-mapped I/O
+CONNECTION_PRAGMAS = (
+    "journal_mode=WAL",
+    "synchronous=NORMAL",
+    "cache_size=-65536",
+    "temp_store=MEMORY",
+    "mmap_size=268435456",
+)
+
+
+# INSERT statements kept as module constants so sqlite3's statement
+# cache sees the same SQL string every time and skips re-parsing it
+SQL_INSERT_TITLE = "INSERT OR IGNORE INTO Titles (title, title_norm) VALUES (?, ?)"
+SQL_INSERT_BOOK = (
+    "INSERT OR IGNORE INTO Books (title_id, book_rating, ratings_count) "
+    "VALUES (?, ?, ?)"
+)
+SQL_INSERT_MOVIE = (
+    "INSERT OR IGNORE INTO Movies (title_id, movie_rating, movie_count) "
+    "VALUES (?, ?, ?)"
+)
+SQL_INSERT_FAILED = "INSERT OR IGNORE INTO FailedTitles (title_id) VALUES (?)"
+
+# Goodreads book links look like /book/show/...
+BOOK_HREF_RE = re.compile(r"/book/show/")
+# Only build <a href="/book/show/..."> tags when parsing a list page
+BOOK_LINKS_ONLY = bs4.SoupStrainer("a", href=BOOK_HREF_RE)
+# Series suffix such as ' (The Hunger Games, #1)'
+SERIES_SUFFIX_RE = re.compile(r"^(.*?)(\s*\(.*?#\d+.*\))$")
+
+# Pieces stripped by normalize_title
+PUNCTUATION_RE = re.compile(r"[^\w\s]")
+TRAILING_ARTICLE_RE = re.compile(r",\s*(the|a|an)$")
+
+# One keep-alive session shared by every HTTP call, so repeated requests
+# to Goodreads / Google Books / OMDb reuse their TCP+TLS connections
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+SESSION.headers.update({"User-Agent": "Mozilla/5.0"})
 
 
 def create_connection():
-    return sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(DB_NAME)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma}")
+    return conn
 
 
 def create_tables(conn):
@@ -20,20 +86,41 @@ def create_tables(conn):
     Create all tables needed for the project.
 
     Titles: scraped list of book titles that have film adaptations
+            (title_norm is the normalized title, unique across variants)
     Books: Google Books data, linked to Titles via title_id
     Movies: OMDb data, linked to Titles via title_id
     FailedTitles: titles that failed either API
+    JoinedRatings: materialized Titles+Books+Movies join used by the analysis
     """
     cur = conn.cursor()
 
     # Scraped titles
     cur.execute("""
         CREATE TABLE IF NOT EXISTS Titles (
-            title_id INTEGER PRIMARY KEY,
-            title    TEXT UNIQUE
+            title_id   INTEGER PRIMARY KEY,
+            title      TEXT UNIQUE,
+            title_norm TEXT
         )
     """)
 
+    # Databases created before title_norm existed: add and backfill it.
+    # Rows whose normalized form is already taken keep NULL (UNIQUE
+    # allows repeated NULLs) so the existing data stays untouched.
+    columns = [col[1] for col in cur.execute("PRAGMA table_info(Titles)")]
+    if "title_norm" not in columns:
+        cur.execute("ALTER TABLE Titles ADD COLUMN title_norm TEXT")
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_titles_norm
+        ON Titles (title_norm)
+    """)
+    missing = cur.execute(
+        "SELECT title_id, title FROM Titles WHERE title_norm IS NULL ORDER BY title_id"
+    ).fetchall()
+    cur.executemany(
+        "UPDATE OR IGNORE Titles SET title_norm = ? WHERE title_id = ?",
+        [(normalize_title(title), title_id) for title_id, title in missing]
+    )
+
     # Google Books
     cur.execute("""
         CREATE TABLE IF NOT EXISTS Books (
@@ -65,6 +152,23 @@ def create_tables(conn):
         )
     """)
 
+    # Materialized book-movie join (rebuilt by refresh_joined_ratings)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS JoinedRatings (
+            title_id     INTEGER PRIMARY KEY,
+            title        TEXT,
+            book_rating  REAL,
+            book_count   INTEGER,
+            movie_rating REAL,
+            movie_count  INTEGER,
+            FOREIGN KEY (title_id) REFERENCES Titles(title_id)
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_joined_counts
+        ON JoinedRatings (book_count, movie_count)
+    """)
+
     conn.commit()
 
 
@@ -75,12 +179,41 @@ def clean_goodreads_title(raw_title: str) -> str:
     into:
       'The Hunger Games'
     """
-    match = re.match(r"^(.*?)(\s*\(.*?#\d+.*\))$", raw_title)
+    match = SERIES_SUFFIX_RE.match(raw_title)
     if match:
         return match.group(1).strip()
     return raw_title.strip()
 
 
+def normalize_title(title: str) -> str:
+    """
+    Canonical form of a title used as a lookup key, so variants like
+      'The Hunger Games', 'Hunger Games, The', 'the hunger games!'
+    all become:
+      'hunger games'
+    (casefolded, punctuation removed, leading/trailing article dropped)
+    """
+    text = TRAILING_ARTICLE_RE.sub("", title.casefold().strip())
+    words = PUNCTUATION_RE.sub("", text).split()
+    if len(words) > 1 and words[0] in ("the", "a", "an"):
+        words = words[1:]
+    return " ".join(words)
+
+
+def fetch_goodreads_page(page_url):
+    """
+    Fetch one Goodreads list page.
+    Returns the raw HTML bytes, or None if the request failed.
+    """
+    try:
+        response = SESSION.get(page_url, timeout=30)
+        response.raise_for_status()
+        return response.content
+    except requests.RequestException as e:
+        print(f"  Goodreads request failed for {page_url}: {e}")
+        return None
+
+
 def scrape_titles_if_needed(conn, max_count=maximumcount):
     """
     Scrape Goodreads list:
@@ -88,7 +221,8 @@ def scrape_titles_if_needed(conn, max_count=maximumcount):
 
     Each run:
       - Only runs if Titles has fewer than max_count rows.
-      - Scrapes pages one by one.
+      - Fetches list pages in small concurrent waves, parsing each wave in
+        order and stopping as soon as the quota is filled.
       - Inserts at most 25 NEW titles into Titles, then stops.
     """
     cur = conn.cursor()
@@ -106,56 +240,76 @@ def scrape_titles_if_needed(conn, max_count=maximumcount):
 
     max_pages = 5          
     max_new_per_run = 25 
+    pages_per_wave = 2     # concurrent fetches per wave
 
     inserted = 0
 
-    for page_num in range(1, max_pages + 1):
-        if inserted >= max_new_per_run or (current_count + inserted) >= max_count:
-            break
-
-        page_url = f"{base_url}?page={page_num}"
-        print(f"  Fetching page {page_num}: {page_url}")
-
-        try:
-            response = requests.get(
-                page_url,
-                timeout=30,
-                headers={"User-Agent": "Mozilla/5.0"}
-            )
-            response.raise_for_status()
-        except requests.RequestException as e:
-            print("  Goodreads request failed on page", page_num, ":", e)
-            break
-
-        soup = bs4.BeautifulSoup(response.text, "html.parser")
-
-        # book title is an <a> whose href looks like /book/show/...
-        all_links = soup.find_all("a", href=re.compile(r"/book/show/"))
+    # normalized titles already stored; anything in here never reaches
+    # an INSERT
+    seen = {
+        title_norm for (title_norm,) in cur.execute("SELECT title_norm FROM Titles")
+    }
 
-        for link in all_links:
+    # pages are fetched a wave at a time (concurrently within a wave) and
+    # parsed in order; a wave is only fetched while the quota is unfilled,
+    # so a run that fills up on page 1 costs at most one extra request.
+    # all inserts share one transaction: committed once at the end,
+    # rolled back if anything raises part-way through
+    with conn:
+        for wave_start in range(1, max_pages + 1, pages_per_wave):
             if inserted >= max_new_per_run or (current_count + inserted) >= max_count:
-                break  
-
-            raw_title = link.get_text(strip=True)
-            if not raw_title:
-                continue
-
-            cleaned = clean_goodreads_title(raw_title)
-            if not cleaned:
-                continue
-
-            try:
-                cur.execute(
-                    "INSERT OR IGNORE INTO Titles (title) VALUES (?)",
-                    (cleaned,)
+                break
+
+            page_nums = range(wave_start, min(wave_start + pages_per_wave, max_pages + 1))
+            page_urls = [f"{base_url}?page={page_num}" for page_num in page_nums]
+            for page_num, page_url in zip(page_nums, page_urls):
+                print(f"  Fetching page {page_num}: {page_url}")
+            with ThreadPoolExecutor(max_workers=len(page_urls)) as executor:
+                pages = list(executor.map(fetch_goodreads_page, page_urls))
+
+            for page_num, content in zip(page_nums, pages):
+                if inserted >= max_new_per_run or (current_count + inserted) >= max_count:
+                    break
+
+                # a failed page is skipped; the others still count
+                if content is None:
+                    continue
+
+                # lxml (C) parser when installed; raw bytes skip a decode round trip.
+                # book title is an <a> whose href looks like /book/show/..., and
+                # the strainer keeps only those tags out of the whole page
+                soup = bs4.BeautifulSoup(
+                    content, HTML_PARSER, parse_only=BOOK_LINKS_ONLY
                 )
+                all_links = soup.find_all("a")
+
+                # clean every link title up front, dropping empties, titles
+                # already stored and repeats across pages (compared by
+                # normalized title; first occurrence wins)
+                new_titles = []
+                for link in all_links:
+                    raw_title = link.get_text(strip=True)
+                    if not raw_title:
+                        continue
+
+                    cleaned = clean_goodreads_title(raw_title)
+                    title_norm = normalize_title(cleaned)
+                    if title_norm and title_norm not in seen:
+                        seen.add(title_norm)
+                        new_titles.append((cleaned, title_norm))
+
+                remaining = min(max_new_per_run - inserted,
+                                max_count - current_count - inserted)
+                batch = new_titles[:remaining]
+
+                before = conn.total_changes
+                try:
+                    cur.executemany(SQL_INSERT_TITLE, batch)
+                except sqlite3.Error as e:
+                    print("  Inserting titles failed on page", page_num, ":", e)
+                    continue
+                inserted += conn.total_changes - before
 
-                if cur.rowcount > 0:
-                    inserted += 1
-            except sqlite3.Error:
-                continue
-
-    conn.commit()
     print(f"Inserted {inserted} new titles into Titles this run.")
 
 
@@ -167,36 +321,119 @@ def get_pending_titles(conn, limit):
       - are NOT marked as failed in FailedTitles
 
     Returns a list of (title_id, title) tuples.
+
+    The handled title_ids are loaded once into a set and Titles is
+    filtered in Python, which avoids a three-way anti-join as the
+    tables grow.
     """
     cur = conn.cursor()
-    cur.execute("""
-        SELECT T.title_id, T.title
-        FROM Titles AS T
-        LEFT JOIN Books        AS B ON T.title_id = B.title_id
-        LEFT JOIN Movies       AS M ON T.title_id = M.title_id
-        LEFT JOIN FailedTitles AS F ON T.title_id = F.title_id
-        WHERE B.title_id IS NULL
-          AND M.title_id IS NULL
-          AND F.title_id IS NULL
-        LIMIT ?
-    """, (limit,))
 
-    return cur.fetchall()
+    done = set()
+    for table in ("Books", "Movies", "FailedTitles"):
+        done.update(title_id for (title_id,) in cur.execute(f"SELECT title_id FROM {table}"))
+
+    pending = []
+    for title_id, title in cur.execute("SELECT title_id, title FROM Titles ORDER BY title_id"):
+        if len(pending) >= limit:
+            break
+        if title_id not in done:
+            pending.append((title_id, title))
+
+    return pending
+
+
+_api_cache_conn = None
+_api_cache_lock = threading.Lock()
+
+
+def _get_api_cache():
+    """
+    Open (once) the API response cache. The fetchers run on worker
+    threads, so the connection is shared and guarded by _api_cache_lock.
+    """
+    global _api_cache_conn
+    if _api_cache_conn is None:
+        _api_cache_conn = sqlite3.connect(API_CACHE_DB, check_same_thread=False)
+        _api_cache_conn.execute("""
+            CREATE TABLE IF NOT EXISTS ApiCache (
+                source     TEXT,
+                query      TEXT,
+                response   TEXT,
+                fetched_at REAL,
+                PRIMARY KEY (source, query)
+            )
+        """)
+        _api_cache_conn.commit()
+    return _api_cache_conn
+
+
+def cache_lookup(source, query):
+    """
+    Return the cached JSON for (source, query), or None if it is missing
+    or older than API_CACHE_TTL. OMDb responses are keyed on the
+    normalized title so title variants share one entry; Google Books
+    responses on the exact search string sent.
+    """
+    with _api_cache_lock:
+        row = _get_api_cache().execute(
+            "SELECT response, fetched_at FROM ApiCache WHERE source = ? AND query = ?",
+            (source, query)
+        ).fetchone()
+
+    if row is None or time.time() - row[1] > API_CACHE_TTL:
+        return None
+    return json_loads(row[0])
+
+
+def cache_store(source, query, raw_json):
+    """
+    Save a successful API response for later runs.
+    """
+    with _api_cache_lock:
+        cache = _get_api_cache()
+        cache.execute(
+            "INSERT OR REPLACE INTO ApiCache (source, query, response, fetched_at) "
+            "VALUES (?, ?, ?, ?)",
+            (source, query, json.dumps(raw_json), time.time())
+        )
+        cache.commit()
+
+
+def build_google_books_query(title):
+    """
+    Build the Google Books search string for a title:
+      'Harry Potter: The Boy Who Lived'  ->  'intitle:"Harry Potter"'
+    The subtitle is dropped and intitle: restricts matches to the title
+    field, so the single result we ask for is far more often the right book.
+    """
+    cleaned = title.replace('"', "").strip()
+    main_title = cleaned.split(":", 1)[0].strip()
+    return f'intitle:"{main_title or cleaned}"'
 
 
 def fetch_google_books_raw(title):
     """
     Call Google Books API and return the raw JSON.
+    Responses are cached on disk (see cache_lookup), keyed on the
+    search string actually sent.
     """
-    params = {"q": title, "maxResults": 1}
+    query = build_google_books_query(title)
+    cached = cache_lookup("google_books", query)
+    if cached is not None:
+        return cached
+
+    params = {"q": query, "maxResults": 1}
     try:
-        resp = requests.get(GOOGLE_BOOKS_URL, params=params, timeout=30)
+        resp = SESSION.get(GOOGLE_BOOKS_URL, params=params, timeout=30)
         resp.raise_for_status()
-        return resp.json()
+        raw_json = json_loads(resp.content)
     except (requests.RequestException, json.JSONDecodeError) as e:
         print(f"Google Books request failed for '{title}': {e}")
         return None
 
+    cache_store("google_books", query, raw_json)
+    return raw_json
+
 
 def parse_google_books_entry(raw_json):
     """
@@ -224,20 +461,25 @@ def parse_google_books_entry(raw_json):
 def fetch_omdb_raw(title):
     """
     Call OMDb API and return raw JSON.
+    Responses are cached on disk (see cache_lookup).
+    OMDB_API_KEY is checked once up front by main.
     """
-    if not OMDB_API_KEY:
-        print("Set OMDB_API_KEY in gather_data.py before running OMDb requests.")
-        return None
+    cached = cache_lookup("omdb", normalize_title(title))
+    if cached is not None:
+        return cached
 
     params = {"t": title, "apikey": OMDB_API_KEY}
     try:
-        resp = requests.get(OMDB_URL, params=params, timeout=30)
+        resp = SESSION.get(OMDB_URL, params=params, timeout=30)
         resp.raise_for_status()
-        return resp.json()
+        raw_json = json_loads(resp.content)
     except (requests.RequestException, json.JSONDecodeError) as e:
         print(f"OMDb request failed for '{title}': {e}")
         return None
 
+    cache_store("omdb", normalize_title(title), raw_json)
+    return raw_json
+
 
 def parse_omdb_entry(raw_json):
     """
@@ -268,92 +510,143 @@ def parse_omdb_entry(raw_json):
     }
 
 
-def insert_adaptation(conn, title_id, book_data, movie_data):
+def save_batch(conn, adaptations, failed_ids):
     """
-    Insert one book+movie pair into:
+    Write one run's results into:
     - Books (linked by title_id)
     - Movies (linked by title_id)
+    - FailedTitles (titles that failed either API)
+
+    `adaptations` is a list of (title_id, book_data, movie_data) tuples,
+    `failed_ids` a list of title_ids. All rows go in with executemany
+    inside a single transaction (one commit per run).
     """
-    cur = conn.cursor()
+    if not adaptations and not failed_ids:
+        return
 
+    book_rows = [
+        (title_id, book_data.get("book_rating"), book_data.get("ratings_count"))
+        for title_id, book_data, _ in adaptations
+    ]
+    movie_rows = [
+        (title_id, movie_data.get("movie_rating"), movie_data.get("movie_count"))
+        for title_id, _, movie_data in adaptations
+    ]
+
+    with conn:
+        cur = conn.cursor()
+        cur.executemany(SQL_INSERT_BOOK, book_rows)
+        cur.executemany(SQL_INSERT_MOVIE, movie_rows)
+        cur.executemany(
+            SQL_INSERT_FAILED,
+            [(title_id,) for title_id in failed_ids]
+        )
 
-    cur.execute("""
-        INSERT OR IGNORE INTO Books (title_id, book_rating, ratings_count)
-        VALUES (?, ?, ?)
-    """, (
-        title_id,
-        book_data.get("book_rating"),
-        book_data.get("ratings_count")
-    ))
 
+def fetch_title_data(title):
+    """
+    Fetch and parse Google Books, then OMDb, for one title.
+    OMDb is only called when Google Books returned usable data.
 
-    cur.execute("""
-        INSERT OR IGNORE INTO Movies (title_id, movie_rating, movie_count)
-        VALUES (?, ?, ?)
-    """, (
-        title_id,
-        movie_data.get("movie_rating"),
-        movie_data.get("movie_count")
-    ))
+    Returns (book_data, movie_data); either may be None.
+    """
+    gb_data = parse_google_books_entry(fetch_google_books_raw(title))
+    if gb_data is None:
+        return None, None
 
-    conn.commit()
+    omdb_data = parse_omdb_entry(fetch_omdb_raw(title))
+    return gb_data, omdb_data
 
 
 def load_batch(conn, max_new=25):
     """
     Load up to max_new NEW adaptations in one run.
     This enforces the 25-items-per-run rule from the project spec.
+
+    The API calls for all pending titles run concurrently on a thread
+    pool (the work is almost all network wait); the database writes
+    stay on the main thread.
     """
     candidate_rows = get_pending_titles(conn, max_new)
 
+    titles = [title for _, title in candidate_rows]
+    with ThreadPoolExecutor(max_workers=MAX_API_WORKERS) as executor:
+        results = list(executor.map(fetch_title_data, titles))
+
+    adaptations = []
+    failed_ids = []
     inserted = 0
-    for title_id, title in candidate_rows:
+    for (title_id, title), (gb_data, omdb_data) in zip(candidate_rows, results):
         if inserted >= max_new:
             break
 
         print(f"Processing '{title}' (title_id={title_id}) ...")
 
         # Google Books
-        gb_raw = fetch_google_books_raw(title)
-        gb_data = parse_google_books_entry(gb_raw)
         if gb_data is None:
             print("  Skipping: no valid Google Books data.")
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT OR IGNORE INTO FailedTitles (title_id) VALUES (?)",
-                (title_id,)
-            )
-
-            conn.commit()
+            failed_ids.append(title_id)
             continue
 
         # OMDb
-        omdb_raw = fetch_omdb_raw(title)
-        omdb_data = parse_omdb_entry(omdb_raw)
         if omdb_data is None:
             print("  Skipping: no valid OMDb data.")
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT OR IGNORE INTO FailedTitles (title_id) VALUES (?)",
-                (title_id,)
-            )
-
-            conn.commit()
+            failed_ids.append(title_id)
             continue
 
-        insert_adaptation(conn, title_id, gb_data, omdb_data)
+        adaptations.append((title_id, gb_data, omdb_data))
         inserted += 1
-        print(f"  Inserted adaptation #{inserted} this run.")
+        print(f"  Queued adaptation #{inserted} this run.")
 
+    save_batch(conn, adaptations, failed_ids)
     print(f"Finished batch: {inserted} new adaptations inserted (max {max_new}).")
 
 
+def refresh_joined_ratings(conn):
+    """
+    Rebuild JoinedRatings from Titles, Books and Movies so the analysis
+    reads one pre-joined table instead of redoing the join every run.
+    Only pairs where both ratings exist are kept.
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM JoinedRatings")
+    cur.execute("""
+        INSERT INTO JoinedRatings
+            (title_id, title, book_rating, book_count, movie_rating, movie_count)
+        SELECT
+            T.title_id,
+            T.title,
+            B.book_rating,
+            B.ratings_count,
+            M.movie_rating,
+            M.movie_count
+        FROM Titles AS T
+        JOIN Books  AS B ON T.title_id = B.title_id
+        JOIN Movies AS M ON T.title_id = M.title_id
+        WHERE B.book_rating IS NOT NULL
+          AND M.movie_rating IS NOT NULL
+    """)
+    conn.commit()
+    print(f"JoinedRatings now has {cur.rowcount} book-movie pairs.")
+
+
 def main():
+    # every OMDb call would be rejected: stop before scraping or spending
+    # any API requests (and before marking good titles as failed)
+    if not OMDB_API_KEY or OMDB_API_KEY == OMDB_KEY_PLACEHOLDER:
+        raise RuntimeError(
+            "Set OMDB_API_KEY in gather_data.py before running OMDb requests."
+        )
+
     conn = create_connection()
     create_tables(conn)
 
     scrape_titles_if_needed(conn, max_count=maximumcount)
     load_batch(conn, max_new=25)
+    refresh_joined_ratings(conn)
+
+    # refresh planner statistics after this run's inserts
+    conn.execute("ANALYZE")
 
     conn.close()
 